@@ -2,6 +2,8 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Tuple, Dict, Union
+from functools import lru_cache
+import numpy as np
 import uvicorn
 
 from set_generator import SetGenerator
@@ -21,29 +23,42 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Initialize the set generator with default rules
-default_sg = SetGenerator()
-
-
 # Create tile mappings (will be used for input/output conversion)
 def create_number_maps(sg):
     colours = ['k', 'b', 'o', 'r']
-    verbose_list = [f'{colours[c]}{n}' for c in range(sg.colours) for n in range(1, sg.numbers + 1)]
-    verbose_list.append('j')
-    tile_map = dict(zip(verbose_list, sg.tiles))
-    r_tile_map = {v: k for k, v in tile_map.items()}
+    verbose = (f'{colours[c]}{n}' for c in range(sg.colours) for n in range(1, sg.numbers + 1))
+    tile_map = dict(zip((*verbose, 'j'), sg.tiles))
+    r_tile_map = [None] * (max(sg.tiles) + 1)
+    for tile, i in tile_map.items():
+        r_tile_map[i] = tile
     return tile_map, r_tile_map
 
 
-tile_map, r_tile_map = create_number_maps(default_sg)
+@lru_cache(maxsize=32)
+def _get_sg_and_maps(numbers=13, colours=4, jokers=2, min_len=3):
+    sg = SetGenerator(numbers=numbers, colours=colours, jokers=jokers, min_len=min_len)
+    tile_map, r_tile_map = create_number_maps(sg)
+    return sg, tile_map, r_tile_map
+
+
+# Face value per tile id (index 0 is unused, jokers count as 0)
+def face_values(sg):
+    values = np.zeros(max(sg.tiles) + 1, dtype=np.int16)
+    values[1:sg.numbers * sg.colours + 1] = np.tile(np.arange(1, sg.numbers + 1), sg.colours)
+    return values
+
+
+# Initialize the set generator with default rules
+default_sg, tile_map, r_tile_map = _get_sg_and_maps(13, 4, 2, 3)
+FACE_VALUE = face_values(default_sg)
 
 def place_joker_in_run(tile_set):
     if not tile_set or tile_set[0] != 'r' or 'j' not in tile_set:
         return tile_set
 
-    tiles = [tile for tile in tile_set[1:] if tile != 'j']
+    tiles = sorted(((int(tile[1:]), tile) for tile in tile_set[1:] if tile != 'j'), key=lambda t: t[0])
 
-    numbers = sorted([int(tile[1:]) for tile in tiles])
+    numbers = [value for value, _ in tiles]
 
     joker_insert_value = None
     for i in range(len(numbers) - 1):
@@ -62,8 +77,7 @@ def place_joker_in_run(tile_set):
 
     new_set = ['r']
     inserted = False
-    for tile in sorted(tiles, key=lambda x: int(x[1:])):
-        value = int(tile[1:])
+    for value, tile in tiles:
         if not inserted and value > joker_insert_value:
             new_set.append('j')
             inserted = True
@@ -100,22 +114,19 @@ class Move(BaseModel):
 @app.post("/solve", response_model=Move)
 def solve_game(game_state: GameState, maximise: str = "tiles", initial_meld: bool = False):
     # Configure game with custom settings if provided
-    if game_state.config:
-        sg = SetGenerator(
-            numbers=game_state.config.numbers,
-            colours=game_state.config.colours,
-            jokers=game_state.config.jokers,
-            min_len=game_state.config.min_len
-        )
-        custom_tile_map, custom_r_tile_map = create_number_maps(sg)
-    else:
-        sg = default_sg
-        custom_tile_map, custom_r_tile_map = tile_map, r_tile_map
+    config = game_state.config or GameConfig()
+    sg, custom_tile_map, custom_r_tile_map = _get_sg_and_maps(
+        config.numbers, config.colours, config.jokers, config.min_len
+    )
+
+    unknown_tiles = set(game_state.rack).union(game_state.table) - custom_tile_map.keys()
+    if unknown_tiles:
+        raise HTTPException(status_code=400, detail=f"Unknown tiles: {', '.join(sorted(unknown_tiles))}")
 
     try:
         # Convert string tiles to internal number representation
-        rack_tiles = [custom_tile_map[t] for t in game_state.rack if t in custom_tile_map]
-        table_tiles = [custom_tile_map[t] for t in game_state.table if t in custom_tile_map]
+        rack_tiles = list(map(custom_tile_map.__getitem__, game_state.rack))
+        table_tiles = list(map(custom_tile_map.__getitem__, game_state.table))
 
         # Create solver instance
         solver = RummikubSolver(
@@ -141,13 +152,16 @@ def solve_game(game_state: GameState, maximise: str = "tiles", initial_meld: boo
                 joker_value=None
             )
         else:
-            tile_list = [solver.tiles[i] for i in range(len(tiles)) for _ in range(int(tiles[i])) if tiles[i] > 0]
-            set_list = [solver.sets[i] for i in range(len(sets)) for _ in range(int(sets[i])) if sets[i] > 0]
+            tile_list = [solver.tiles[i] for i, count in tiles.items() for _ in range(count)]
+            set_list = [solver.sets[i] for i, count in sets.items() for _ in range(count)]
 
             readable_tiles = [custom_r_tile_map[t] for t in tile_list]
             readable_sets = [[custom_r_tile_map[t] for t in s] for s in set_list]
 
-            point_value = 0
+            # Real tiles are scored from their ids
+            face_value = FACE_VALUE if sg is default_sg else face_values(sg)
+            set_ids = [t for s in set_list for t in s]
+            point_value = int(face_value[set_ids].sum())
             joker_value = None
 
             labeled_sets = []
@@ -177,12 +191,17 @@ def solve_game(game_state: GameState, maximise: str = "tiles", initial_meld: boo
                     set_type = 'r'
 
                 labeled_set = [set_type] + set_tiles
+                if set_type == 'r':
+                    try:
+                        labeled_set = place_joker_in_run(labeled_set)
+                    except Exception as e:
+                        print("parse error", e)
                 labeled_sets.append(labeled_set)
 
+                sorted_numbers = sorted(numbers)
                 for tile in set_tiles:
                     if tile == 'j':
                         if is_run and numbers:
-                            sorted_numbers = sorted(numbers)
                             if len(sorted_numbers) > 1:
                                 for i in range(len(sorted_numbers) - 1):
                                     if sorted_numbers[i + 1] - sorted_numbers[i] > 1:
@@ -190,11 +209,11 @@ def solve_game(game_state: GameState, maximise: str = "tiles", initial_meld: boo
                                         point_value += joker_value
                                         break
                                 else:
-                                    if min(sorted_numbers) > 1:
-                                        joker_value = min(sorted_numbers) - 1  # Joker before min
+                                    if sorted_numbers[0] > 1:
+                                        joker_value = sorted_numbers[0] - 1  # Joker before min
                                         point_value += joker_value
                                     else:
-                                        joker_value = max(sorted_numbers) + 1  # Joker after max
+                                        joker_value = sorted_numbers[-1] + 1  # Joker after max
                                         point_value += joker_value
                             else:
                                 joker_value = numbers[0]
@@ -205,17 +224,6 @@ def solve_game(game_state: GameState, maximise: str = "tiles", initial_meld: boo
                         else:
                             joker_value = 0
                             point_value += 0
-                    else:
-                        try:
-                            point_value += int(tile[1:])
-                        except ValueError:
-                            pass
-
-            for i, lset in enumerate(labeled_sets):
-                try:
-                    labeled_sets[i] = place_joker_in_run(lset)
-                except Exception as e:
-                    print("parse error", e)
 
             if initial_meld and point_value < 30:
                 return Move(
@@ -31,7 +31,9 @@ def create_number_maps(sg):
     verbose_list = [f'{colours[c]}{n}' for c in range(sg.colours) for n in range(1, sg.numbers + 1)]
     verbose_list.append('j')
     tile_map = dict(zip(verbose_list, sg.tiles))
-    r_tile_map = {v: k for k, v in tile_map.items()}
+    r_tile_map = [None] * (max(sg.tiles) + 1)
+    for tile, i in tile_map.items():
+        r_tile_map[i] = tile
     return tile_map, r_tile_map
 
 
@@ -40,8 +42,8 @@ def print_solution(solver, r_tile_map, maximise='tiles', initial_meld=False):
     if value == 0 or (initial_meld and value < 30):
         print('No solution found - pick up.')
     else:
-        tile_list = [solver.tiles[i] for i in range(len(tiles)) if tiles[i] == 1]
-        set_list = [solver.sets[i] for i in range(len(sets)) if sets[i] == 1]
+        tile_list = [solver.tiles[i] for i, count in tiles.items() for _ in range(count)]
+        set_list = [solver.sets[i] for i, count in sets.items() for _ in range(count)]
         print(f"Using the following tiles from your rack:\n{', '.join([r_tile_map[t] for t in tile_list])}")
         print('Make the following sets:')
         for s in set_list:
@@ -1,124 +1,146 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Tuple, Dict, Union
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional, Tuple, Dict, Union, Literal
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from types import MappingProxyType
+from hashlib import blake2b
+import asyncio
+import os
+import orjson
 import uvicorn
 
 from set_generator import SetGenerator
 from solver import RummikubSolver
+from response_format import COLOURS, label_sets, parse_tile
+
+# Cores available to this process, counted like nproc
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Solves run in a process pool per uvicorn worker, splitting the cores between workers
+SOLVE_WORKERS = max(1, available_cpus() // int(os.environ.get("WEB_CONCURRENCY", 1)))
+
+
+# Warms each pool process with one solve per objective
+def _child_init():
+    solver = RummikubSolver.from_cached(DEFAULT_SG_KEY)
+    solver.reset(rack=default_sg.tiles[:3])
+    solver.solve(maximise='tiles')
+    solver.solve(maximise='value')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.pool = ProcessPoolExecutor(max_workers=SOLVE_WORKERS, initializer=_child_init)
+    # Start every pool process before serving
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(app.state.pool, int) for _ in range(SOLVE_WORKERS)))
+    yield
+    app.state.pool.shutdown()
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
 
 app = FastAPI(
     title="Rummikub Solver API",
     description="API for solving optimal Rummikub moves",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allows all origins - for development only
-    allow_credentials=True,
-    allow_methods=["*"],  # Allows all methods
-    allow_headers=["*"],  # Allows all headers
-)
+# Allows all origins, methods and headers - for development only
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"*"),
+    (b"access-control-allow-headers", b"*"),
+]
+
+
+class AllowAllCORSMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS":
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": CORS_HEADERS + [(b"content-length", b"0")],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + CORS_HEADERS
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
 
-# Initialize the set generator with default rules
-default_sg = SetGenerator()
+
+app.add_middleware(AllowAllCORSMiddleware)
+
+
+# Tile names for the default 13-number, 4-colour game
+DEFAULT_VERBOSE = tuple(c + str(n) for c in COLOURS for n in range(1, 14)) + ('j',)
 
 
 # Create tile mappings (will be used for input/output conversion)
-def create_number_maps(sg):
-    colours = ['k', 'b', 'o', 'r']
-    verbose_list = [f'{colours[c]}{n}' for c in range(sg.colours) for n in range(1, sg.numbers + 1)]
-    verbose_list.append('j')
-    tile_map = dict(zip(verbose_list, sg.tiles))
-    r_tile_map = {v: k for k, v in tile_map.items()}
-    return tile_map, r_tile_map
-
-
-def sum_group(tile_set):
-    tiles = tile_set[1:]
-    joker_count = tiles.count('j')
-    real_tiles = [tile for tile in tiles if tile != 'j']
-
-    numbers = [int(tile[1:]) for tile in real_tiles]
-    base_value = numbers[0]
-
-    total = base_value * len(real_tiles) + base_value * joker_count
-    return tile_set, total
-
-
-def place_joker_in_run(tile_set):
-    if not tile_set or tile_set[0] != 'r' or 'j' not in tile_set:
-        total = sum(int(tile[1:]) for tile in tile_set[1:] if tile != 'j')
-        return tile_set, total, []
-
-    tiles = [tile for tile in tile_set[1:] if tile != 'j']
-    joker_count = tile_set.count('j')
-
-    numbers = sorted([int(tile[1:]) for tile in tiles])
-    filled_numbers = []
-    inserted_jokers = 0
-    joker_values = []
-    i = 0
-
-    while i < len(numbers) - 1:
-        filled_numbers.append(numbers[i])
-        gap = numbers[i + 1] - numbers[i]
-        if gap == 1:
-            i += 1
-            continue
-        elif gap > 1:
-            missing = gap - 1
-            if inserted_jokers + missing <= joker_count:
-                for j in range(1, gap):
-                    value = numbers[i] + j
-                    filled_numbers.append(value)
-                    joker_values.append(value)
-                inserted_jokers += missing
-            else:
-                break
-        i += 1
-
-    filled_numbers.append(numbers[-1])
-
-    while inserted_jokers < joker_count:
-        if filled_numbers[-1] < 13:
-            value = filled_numbers[-1] + 1
-            filled_numbers.append(value)
-            joker_values.append(value)
-        elif filled_numbers[0] > 1:
-            value = filled_numbers[0] - 1
-            filled_numbers.insert(0, value)
-            joker_values.insert(0, value)
-        else:
-            break
-        inserted_jokers += 1
-
-    filled_numbers.sort()
-
-    new_set = ['r']
-    total_sum = 0
-    tiles_copy = tiles.copy()
-
-    for num in filled_numbers:
-        if tiles_copy and int(tiles_copy[0][1:]) == num:
-            tile = tiles_copy.pop(0)
-            new_set.append(tile)
-            total_sum += num
-        else:
-            new_set.append('j')
-            total_sum += num
-
-    return new_set, total_sum, joker_values
-
-tile_map, r_tile_map = create_number_maps(default_sg)
+def create_number_maps(numbers, colours, tiles):
+    if numbers == 13 and colours == 4:
+        verbose_list = DEFAULT_VERBOSE
+    else:
+        verbose_list = [f'{COLOURS[c]}{n}' for c in range(colours) for n in range(1, numbers + 1)]
+        verbose_list.append('j')
+    tile_map = dict(zip(verbose_list, tiles))
+    r_tile_map = [None] * (max(tiles) + 1)
+    for tile, i in tile_map.items():
+        r_tile_map[i] = tile
+    return MappingProxyType(tile_map), tuple(r_tile_map)
+
+
+# Same tile ids as SetGenerator.tiles, without generating any sets
+@lru_cache(maxsize=32)
+def get_tile_maps(numbers=13, colours=4, jokers=2):
+    tiles = range(1, numbers * colours + 1 + (1 if jokers else 0))
+    tile_map, r_tile_map = create_number_maps(numbers, colours, tiles)
+    return tiles, tile_map, r_tile_map
+
+
+# Initialize the set generator with default rules
+DEFAULT_SG_KEY = (13, 4, 2, 3)
+default_sg = SetGenerator(*DEFAULT_SG_KEY)
+_, tile_map, r_tile_map = get_tile_maps(13, 4, 2)
+assert DEFAULT_VERBOSE == tuple(tile_map) and list(get_tile_maps(13, 4, 2)[0]) == default_sg.tiles
+
 
 # Pydantic models for request and response
 class GameConfig(BaseModel):
-    numbers: int = 13
-    colours: int = 4
-    jokers: int = 2
-    min_len: int = 3
+    numbers: int = Field(13, ge=1, le=13)
+    colours: int = Field(4, ge=1, le=len(COLOURS))
+    jokers: int = Field(2, ge=0, le=4)
+    min_len: int = Field(3, ge=1)
+
+    @model_validator(mode="after")
+    def check_min_len(self):
+        if self.min_len > self.numbers:
+            raise ValueError("min_len cannot be larger than numbers")
+        return self
 
 
 class GameState(BaseModel):
@@ -127,6 +149,13 @@ class GameState(BaseModel):
     config: Optional[GameConfig] = None
 
 
+# Same as GameState, with tiles given as tile codes
+class GameStateInt(BaseModel):
+    rack: List[int] = Field(description="Tile codes as in SetGenerator.tiles, colour-major from 1 with the joker last (k1=1 ... r13=52, j=53 by default)")
+    table: List[int] = Field(description="Tile codes as in SetGenerator.tiles")
+    config: Optional[GameConfig] = None
+
+
 class Move(BaseModel):
     tiles_to_play: List[str]
     sets_to_make: List[Tuple[List[str], List[int]]]
@@ -136,154 +165,163 @@ class Move(BaseModel):
     joker_value: Optional[int] = None
 
 
+Maximise = Literal["tiles", "value"]
 
-@app.post("/solve", response_model=Move)
-def solve_game(game_state: GameState, maximise: str = "tiles", initial_meld: bool = False):
-    # Configure game with custom settings if provided
-    if game_state.config:
-        sg = SetGenerator(
-            numbers=game_state.config.numbers,
-            colours=game_state.config.colours,
-            jokers=game_state.config.jokers,
-            min_len=game_state.config.min_len
+
+NO_MOVE = Move(
+    tiles_to_play=[],
+    sets_to_make=[],
+    value=0,
+    success=False,
+    message="No valid move found - should pick up a tile.",
+    joker_value=None
+)
+
+
+# LRU cache of solve results per normalised request
+SOLVE_CACHE_SIZE = 4096
+solve_cache = OrderedDict()
+
+
+# Runs inside the process pool
+def _solve_blocking(sg_key, rack_tiles, table_tiles, maximise, initial_meld):
+    solver = RummikubSolver.from_cached(sg_key)
+    solver.reset(rack_tiles, table_tiles)
+
+    value, tile_counts, set_counts = solver.solve(maximise=maximise, initial_meld=initial_meld)
+    if value == 0:
+        return value, [], []
+
+    tile_list = [int(solver.tiles[i]) for i, count in tile_counts.items() for _ in range(count)]
+    set_list = [solver.sets[i] for i, count in set_counts.items() for _ in range(count)]
+    return value, tile_list, set_list
+
+
+# Shared by /solve and /solve_int once the tiles are ids
+async def _solve_core(sg_key, rack_tiles, table_tiles, maximise, initial_meld, nocache):
+    numbers, colours, jokers, _ = sg_key
+    _, _, custom_r_tile_map = get_tile_maps(numbers, colours, jokers)
+
+    # The table is not used for an initial meld
+    rack_key = tuple(sorted(rack_tiles))
+    table_key = () if initial_meld else tuple(sorted(table_tiles))
+    key = (sg_key, rack_key, table_key, maximise, initial_meld)
+    headers = {"ETag": f'W/"{blake2b(repr(key).encode(), digest_size=8).hexdigest()}"'}
+
+    if not rack_tiles:
+        return ORJSONResponse(NO_MOVE.model_dump(), headers=headers)
+    if initial_meld:
+        # Upper bound on the meld, with jokers at the highest number
+        rack_names = map(custom_r_tile_map.__getitem__, rack_tiles)
+        max_meld = sum(numbers if t == 'j' else parse_tile(t)[1] for t in rack_names)
+        if max_meld < 30:
+            return ORJSONResponse(Move.model_construct(
+                tiles_to_play=[],
+                sets_to_make=[],
+                value=0.0,
+                success=False,
+                message=f"Initial meld requires 30+ points. Rack holds at most {max_meld} points.",
+            ).model_dump(), headers=headers)
+
+    result = None if nocache else solve_cache.get(key)
+    if result is None:
+        # Find solution
+        result = await asyncio.get_running_loop().run_in_executor(
+            app.state.pool, _solve_blocking, sg_key, rack_key, table_key, maximise, initial_meld
         )
-        custom_tile_map, custom_r_tile_map = create_number_maps(sg)
+        solve_cache[key] = result
+        if len(solve_cache) > SOLVE_CACHE_SIZE:
+            solve_cache.popitem(last=False)
     else:
-        sg = default_sg
-        custom_tile_map, custom_r_tile_map = tile_map, r_tile_map
-
-    try:
-        # Convert string tiles to internal number representation
-        rack_tiles = [custom_tile_map[t] for t in game_state.rack if t in custom_tile_map]
-        table_tiles = [custom_tile_map[t] for t in game_state.table if t in custom_tile_map]
-
-        # Create solver instance
-        solver = RummikubSolver(
-            tiles=sg.tiles,
-            sets=sg.sets,
-            numbers=sg.numbers,
-            colours=sg.colours,
-            rack=rack_tiles,
-            table=table_tiles
-        )
+        solve_cache.move_to_end(key)
+    value, tile_list, set_list = result
 
-        # Find solution
-        value, tiles, sets = solver.solve(maximise=maximise, initial_meld=initial_meld)
+    # Format the response
+    if value == 0:
+        return ORJSONResponse(NO_MOVE.model_dump(), headers=headers)
+    else:
+        readable_sets = [[custom_r_tile_map[t] for t in s] for s in set_list]
+        labeled_sets, point_value = label_sets(readable_sets, initial_meld, numbers)
 
-        # Format the response
-        if value == 0:
-            return Move(
+        if initial_meld and point_value < 30:
+            return ORJSONResponse(Move.model_construct(
                 tiles_to_play=[],
                 sets_to_make=[],
-                value=0,
+                value=float(point_value),
                 success=False,
-                message="No valid move found - should pick up a tile.",
-                joker_value=None
-            )
-        else:
-            tile_list = [solver.tiles[i] for i in range(len(tiles)) for _ in range(int(tiles[i])) if tiles[i] > 0]
-            set_list = [solver.sets[i] for i in range(len(sets)) for _ in range(int(sets[i])) if sets[i] > 0]
-
-            readable_tiles = [custom_r_tile_map[t] for t in tile_list]
-            readable_sets = [[custom_r_tile_map[t] for t in s] for s in set_list]
-
-            point_value = 0
-            labeled_sets = []
-
-            def identify(tile_set):
-                jokers = 0
-                colors = []
-                numbers = []
-                for tile in tile_set:
-                    if tile == "j":
-                        jokers += 1
-                        numbers.append(tile)
-                    else:
-                        colors.append(tile[0])
-                        numbers.append(tile[1:])
-                number_of_colors = len(set(colors));
-                if jokers == 0:
-                    if number_of_colors == 1:
-                        tile_set = ["r"] + tile_set
-                        return place_joker_in_run(tile_set)
-                    else:
-                        tile_set = ["g"] + tile_set
-                        ts, total = sum_group(tile_set)
-                        return ts, total, []
-
-                elif jokers == 1:
-                    if number_of_colors == 1:
-                        tile_set = ["r"] + tile_set
-                        return place_joker_in_run(tile_set)
-                    else:
-                        tile_set = ["g"] + tile_set
-                        ts, total = sum_group(tile_set)
-                        return ts, total, []
-
-                else:
-                    if number_of_colors == 1 and len(
-                            tile_set) == 3:  # this special combination means that the set could be a run or a group, and the best option needs to be chosen
-                        tile_set_g, grp_sum = sum_group(["g"] + tile_set)
-                        tile_set_r, run_sum, joker_arr = place_joker_in_run(["r"] + tile_set)
-                        if initial_meld:
-                            if run_sum > grp_sum:
-                                return tile_set_r, run_sum, joker_arr
-                            else:
-                                return tile_set_g, grp_sum, []
-                        else:
-                            tile_set = ["g"] + tile_set
-                            ts, total = sum_group(tile_set)
-                            return ts, total, []
-                    elif number_of_colors == 1 and len(tile_set) > 3:
-                        return place_joker_in_run(["r"] + tile_set)
-                    else:
-                        tile_set = ["g"] + tile_set
-                        ts, total = sum_group(tile_set)
-                        return ts, total, []
-
-            for lset in readable_sets:
-                try:
-                    result = identify(lset)
-                    if len(result) == 3:
-                        set_to_add, value_to_add, joker_arr = result
-                    else:
-                        set_to_add, value_to_add = result
-                        joker_arr = []
-
-                    point_value += value_to_add
-                    labeled_sets.append((set_to_add, joker_arr))
-                except Exception as e:
-                    print("parse error", e)
-
-            if initial_meld and point_value < 30:
-                return Move(
-                    tiles_to_play=[],
-                    sets_to_make=[],
-                    value=point_value,
-                    success=False,
-                    message=f"Initial meld requires 30+ points. Current play: {point_value} points. {readable_sets}",
-                )
-
-            return Move(
-                tiles_to_play=readable_tiles,
-                sets_to_make=labeled_sets,
-                value=point_value,
-                success=True,
-                message=f"Valid move found. Point value: {point_value}",
-            )
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error solving game: {str(e)}")
+                message=f"Initial meld requires 30+ points. Current play: {point_value} points. {readable_sets}",
+            ).model_dump(), headers=headers)
+
+        return ORJSONResponse(Move.model_construct(
+            tiles_to_play=[custom_r_tile_map[t] for t in tile_list],
+            sets_to_make=labeled_sets,
+            value=float(point_value),
+            success=True,
+            message=f"Valid move found. Point value: {point_value}",
+        ).model_dump(), headers=headers)
+
+
+@app.post("/solve", response_model=None, responses={200: {"model": Move}})
+async def solve_game(game_state: GameState, maximise: Maximise = "tiles", initial_meld: bool = False,
+                     nocache: bool = False):
+    # Configure game with custom settings if provided
+    config = game_state.config or GameConfig()
+    sg_key = (config.numbers, config.colours, config.jokers, config.min_len)
+    _, custom_tile_map, _ = get_tile_maps(config.numbers, config.colours, config.jokers)
+
+    unknown_tiles = set(game_state.rack).union(game_state.table) - custom_tile_map.keys()
+    if unknown_tiles:
+        raise HTTPException(status_code=400, detail=f"Unknown tiles: {', '.join(sorted(unknown_tiles))}")
+
+    # Convert string tiles to internal number representation
+    rack_tiles = list(map(custom_tile_map.__getitem__, game_state.rack))
+    table_tiles = list(map(custom_tile_map.__getitem__, game_state.table))
+    return await _solve_core(sg_key, rack_tiles, table_tiles, maximise, initial_meld, nocache)
+
+
+@app.post("/solve_int", response_model=None, responses={200: {"model": Move}})
+async def solve_game_int(game_state: GameStateInt, maximise: Maximise = "tiles", initial_meld: bool = False,
+                         nocache: bool = False):
+    config = game_state.config or GameConfig()
+    sg_key = (config.numbers, config.colours, config.jokers, config.min_len)
+    tiles, _, _ = get_tile_maps(config.numbers, config.colours, config.jokers)
+
+    unknown_tiles = set(game_state.rack).union(game_state.table).difference(tiles)
+    if unknown_tiles:
+        raise HTTPException(status_code=400, detail=f"Unknown tile codes: {', '.join(map(str, sorted(unknown_tiles)))}")
+
+    return await _solve_core(sg_key, game_state.rack, game_state.table, maximise, initial_meld, nocache)
+
+
+RULES_PAYLOAD = orjson.dumps({
+    "numbers": default_sg.numbers,
+    "colours": default_sg.colours,
+    "jokers": default_sg.jokers,
+    "min_len": default_sg.min_len
+})
+RULES_HEADERS = {
+    "ETag": f'"{blake2b(RULES_PAYLOAD, digest_size=8).hexdigest()}"',
+    "Cache-Control": "public, max-age=3600",
+}
+
+
+# If-None-Match uses weak comparison and may list several tags or be "*"
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
 
 
 @app.get("/rules")
-def get_default_rules():
-    return {
-        "numbers": default_sg.numbers,
-        "colours": default_sg.colours,
-        "jokers": default_sg.jokers,
-        "min_len": default_sg.min_len
-    }
+async def get_default_rules(request: Request):
+    if etag_matches(request.headers.get("if-none-match"), RULES_HEADERS["ETag"]):
+        return Response(status_code=304, headers=RULES_HEADERS)
+    return Response(content=RULES_PAYLOAD, media_type="application/json", headers=RULES_HEADERS)
+
 
 @app.get("/")
 def read_root():
@@ -292,4 +330,9 @@ def read_root():
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    if os.environ.get("DEV") == "1":
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        os.environ.setdefault("WEB_CONCURRENCY", str(available_cpus()))
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools",
+                    workers=int(os.environ["WEB_CONCURRENCY"]))
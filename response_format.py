@@ -0,0 +1,137 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+# Set labelling and scoring, annotated for mypyc (see Dockerfile)
+
+COLOURS = 'kbor'
+
+LabeledSet = Tuple[List[str], List[int]]
+
+
+# (colour index, number); jokers map to (-1, 0)
+@lru_cache(maxsize=None)
+def parse_tile(tile: str) -> Tuple[int, int]:
+    if tile == 'j':
+        return -1, 0
+    return COLOURS.index(tile[0]), int(tile[1:])
+
+
+def sum_group(tile_set: List[str]) -> Tuple[List[str], int]:
+    parsed = [parse_tile(tile) for tile in tile_set[1:]]
+    numbers = [number for colour, number in parsed if colour >= 0]
+
+    total = numbers[0] * len(parsed)
+    return tile_set, total
+
+
+# Fills gaps in the run with jokers, then extends it up (or down at max_num) with the rest
+def _fill_run(numbers: List[int], joker_count: int, max_num: int) -> Tuple[List[int], List[int]]:
+    present = 0
+    for number in numbers:
+        present |= 1 << number
+    low, high = numbers[0], numbers[-1]
+
+    span = (1 << (high + 1)) - (1 << low)
+    missing = bin(span & ~present).count('1')
+    if missing <= joker_count:
+        filled = span
+        spare = joker_count - missing
+    else:
+        filled = present
+        spare = joker_count
+
+    up = min(spare, max_num - high)
+    down = min(spare - up, low - 1)
+    filled |= ((1 << (high + up + 1)) - (1 << (high + 1))) | ((1 << low) - (1 << (low - down)))
+
+    jokers = filled & ~present
+    filled_numbers = [n for n in range(low - down, high + up + 1) if filled >> n & 1]
+    joker_values = [n for n in filled_numbers if jokers >> n & 1]
+    return filled_numbers, joker_values
+
+
+def place_joker_in_run(tile_set: List[str], max_num: int = 13) -> Tuple[List[str], int, List[int]]:
+    if not tile_set or tile_set[0] != 'r' or 'j' not in tile_set:
+        total = sum(parse_tile(tile)[1] for tile in tile_set[1:])
+        return tile_set, total, []
+
+    parsed = [(parse_tile(tile), tile) for tile in tile_set[1:]]
+    tiles = sorted((number, tile) for (colour, number), tile in parsed if colour >= 0)
+    joker_count = len(parsed) - len(tiles)
+
+    filled_numbers, joker_values = _fill_run([num for num, _ in tiles], joker_count, max_num)
+
+    new_set = ['r']
+    i = 0
+    for num in filled_numbers:
+        if i < len(tiles) and tiles[i][0] == num:
+            new_set.append(tiles[i][1])
+            i += 1
+        else:
+            new_set.append('j')
+
+    return new_set, sum(filled_numbers), joker_values
+
+
+@lru_cache(maxsize=8192)
+def identify(tile_set: Tuple[str, ...], initial_meld: bool = False,
+             max_num: int = 13) -> Tuple[List[str], int, List[int]]:
+    tiles = list(tile_set)
+    jokers = 0
+    colour_mask = 0
+    for tile in tiles:
+        colour, _ = parse_tile(tile)
+        if colour < 0:
+            jokers += 1
+        else:
+            colour_mask |= 1 << colour
+    number_of_colors = bin(colour_mask).count('1')
+    if jokers == 0:
+        if number_of_colors == 1:
+            return place_joker_in_run(["r"] + tiles, max_num)
+        else:
+            ts, total = sum_group(["g"] + tiles)
+            return ts, total, []
+
+    elif jokers == 1:
+        if number_of_colors == 1:
+            return place_joker_in_run(["r"] + tiles, max_num)
+        else:
+            ts, total = sum_group(["g"] + tiles)
+            return ts, total, []
+
+    else:
+        if number_of_colors == 1 and len(
+                tiles) == 3:  # this special combination means that the set could be a run or a group, and the best option needs to be chosen
+            tile_set_g, grp_sum = sum_group(["g"] + tiles)
+            tile_set_r, run_sum, joker_arr = place_joker_in_run(["r"] + tiles, max_num)
+            if initial_meld:
+                if run_sum > grp_sum:
+                    return tile_set_r, run_sum, joker_arr
+                else:
+                    return tile_set_g, grp_sum, []
+            else:
+                ts, total = sum_group(["g"] + tiles)
+                return ts, total, []
+        elif number_of_colors == 1 and len(tiles) > 3:
+            return place_joker_in_run(["r"] + tiles, max_num)
+        else:
+            ts, total = sum_group(["g"] + tiles)
+            return ts, total, []
+
+
+# Labels every set in a solution and adds up its point value
+def label_sets(readable_sets: List[List[str]], initial_meld: bool,
+               max_num: int) -> Tuple[List[LabeledSet], int]:
+    point_value = 0
+    labeled_sets: List[LabeledSet] = []
+    for lset in readable_sets:
+        try:
+            set_to_add, value_to_add, joker_arr = identify(tuple(lset), initial_meld, max_num)
+
+            point_value += value_to_add
+            # Copy, as the cached lists are shared
+            labeled_sets.append((list(set_to_add), list(joker_arr)))
+        except Exception as e:
+            print("parse error", e)
+    return labeled_sets, point_value
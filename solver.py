@@ -1,6 +1,11 @@
 import cvxpy as cp
 import numpy as np
 
+from copy import copy
+from functools import lru_cache
+
+from set_generator import SetGenerator
+
 
 class RummikubSolver:
 
@@ -14,15 +19,33 @@ class RummikubSolver:
         if self.value.shape != self.tiles.shape:
             self.value = np.append(self.value, 0.1)
 
-        self.sets_matrix = np.array(
-            [np.array([self.sets[j].count(self.tiles[i]) for j in range(len(self.sets))]) for i in
-             range(len(self.tiles))])
-        self.table_array = np.array([self.table.count(self.tiles[i]) for i in range(len(self.tiles))])
-        self.rack_array = np.array([self.rack.count(self.tiles[i]) for i in range(len(self.tiles))])
+        # Sets as one padded 2D array, -1 marks unused slots
+        self.sets_array = pad_sets(self.sets)
+        tile_index = np.full(self.tiles.max() + 1, -1)
+        tile_index[self.tiles] = np.arange(len(self.tiles))
+        set_idx, slot = np.nonzero(self.sets_array >= 0)
+        rows = tile_index[self.sets_array[set_idx, slot]]
+        self.sets_matrix = np.zeros((len(self.tiles), len(self.sets)), dtype=int)
+        np.add.at(self.sets_matrix, (rows[rows >= 0], set_idx[rows >= 0]), 1)
+        self.problems = {}
+        self.update_arrays()
+
+    @classmethod
+    def from_cached(cls, sg_key, table=[]):
+        # Shallow copy: rules-dependent arrays and problems are shared
+        solver = copy(_template_solver(sg_key))
+        solver.reset(table=table)
+        return solver
+
+    def reset(self, rack=[], table=[]):
+        self.rack = sorted(rack)
+        self.table = sorted(table)
+        self.update_arrays()
 
     def update_arrays(self):
-        self.table_array = np.array([self.table.count(self.tiles[i]) for i in range(len(self.tiles))])
-        self.rack_array = np.array([self.rack.count(self.tiles[i]) for i in range(len(self.tiles))])
+        size = self.tiles.max() + 1
+        self.table_array = np.bincount(np.asarray(self.table, dtype=int), minlength=size)[self.tiles]
+        self.rack_array = np.bincount(np.asarray(self.rack, dtype=int), minlength=size)[self.tiles]
 
     def add_rack(self, additions):
         for i in additions:
@@ -52,44 +75,69 @@ class RummikubSolver:
                 print(f'{i} not on table')
         self.update_arrays()
 
+    def get_problem(self, maximise):
+        # Built once per objective, with the table and rack as parameters
+        if maximise not in self.problems:
+            t = cp.Parameter(len(self.tiles))
+            r = cp.Parameter(len(self.tiles))
+            x = cp.Variable(len(self.sets), integer=True)
+            y = cp.Variable(len(self.tiles), integer=True)
+
+            if maximise == 'tiles':
+                obj = cp.Maximize(cp.sum(y))
+            else:
+                obj = cp.Maximize(self.value @ y)
+
+            constraints = [
+                self.sets_matrix @ x == t + y,
+                y <= r,
+                -x <= 0,
+                x <= 2,
+                -y <= 0,
+                y <= 2,
+            ]
+
+            self.problems[maximise] = cp.Problem(obj, constraints), t, r, x, y
+        return self.problems[maximise]
+
     def solve(self, maximise='tiles', initial_meld=False):
-        i = range(len(self.tiles))
-        j = range(len(self.sets))
+        if maximise not in ('tiles', 'value'):
+            print('Invalid maximise function')
+            return 0, {}, {}
 
-        s = self.sets_matrix
+        prob, t, r, x, y = self.get_problem(maximise)
         if initial_meld:
-            t = np.zeros(self.table_array.shape)
+            t.value = np.zeros(self.table_array.shape)
         else:
-            t = self.table_array
-        r = self.rack_array
-        v = self.value
+            t.value = self.table_array
+        r.value = self.rack_array
 
-        x = cp.Variable(len(j), integer=True)
-        y = cp.Variable(len(i), integer=True)
-
-        if maximise == 'tiles':
-            obj = cp.Maximize(cp.sum(y))
-        elif maximise == 'value':
-            obj = cp.Maximize(cp.sum(v*y))
-        else:
-            print('Invalid maximise function')
-            return 0, np.zeros(len(j)), np.zeros(len(i)),
-
-        constraints = [
-            s @ x == t + y,
-            y <= r,
-            -x <= 0,
-            x <= 2,
-            -y <= 0,
-            y <= 2,
-        ]
-
-        prob = cp.Problem(obj, constraints)
         prob.solve(solver=cp.GLPK_MI)
 
-        if len(list(prob.solution.primal_vars.keys())) == 0:
+        if y.value is None or x.value is None:
             print('No prob.solution.primal_vars')
-            return 0, np.zeros(len(i)), np.zeros(len(j))
+            return 0, {}, {}
+
+        # Sparse {index: count} results
+        return prob.value, nonzero_counts(y.value), nonzero_counts(x.value)
+
+
+def pad_sets(sets, pad=-1):
+    width = max((len(s) for s in sets), default=0)
+    array = np.full((len(sets), width), pad, dtype=np.int16)
+    for j, s in enumerate(sets):
+        array[j, :len(s)] = s
+    return array
+
+
+def nonzero_counts(values):
+    counts = np.rint(values).astype(int)
+    idx = np.flatnonzero(counts)
+    return dict(zip(idx.tolist(), counts[idx].tolist()))
+
 
-        return prob.value, prob.solution.primal_vars[list(prob.solution.primal_vars.keys())[0]], \
-               prob.solution.primal_vars[list(prob.solution.primal_vars.keys())[1]]
+# One template solver per (numbers, colours, jokers, min_len)
+@lru_cache(maxsize=32)
+def _template_solver(sg_key):
+    sg = SetGenerator(*sg_key)
+    return RummikubSolver(tiles=sg.tiles, sets=sg.sets, numbers=sg.numbers, colours=sg.colours)